@@ -2,12 +2,18 @@
 
 """Generate API reference documentation for a package."""
 
+import argparse
+import concurrent.futures
+import functools
+import hashlib
 import importlib
+import importlib.util
+import inspect
 import os
 import pathlib
-import pkgutil
 import re
 import sys
+import threading
 
 import setuptools
 
@@ -56,6 +62,29 @@ Module Functions
     :exclude-members: get_script_argument_parser
 """
 
+GENERATOR_SOURCE = pathlib.Path(__file__).read_bytes()
+"""
+Source of this script.
+
+Module documentation digests include this so that any change to how documentation
+is generated invalidates every previously generated module documentation file.
+"""
+
+MIN_MODULES_FOR_THREAD_POOL = 4
+"""
+Minimum number of modules to document before imports are run in a thread pool.
+
+Below this, the overhead of starting threads outweighs any overlap between imports.
+"""
+
+MAX_WORKERS = 32
+"""
+Maximum number of threads used to import modules.
+
+This matches the upper bound of `ThreadPoolExecutor`'s default. Imports are mostly
+GIL-bound, so more threads would not add overlap.
+"""
+
 ARGPARSE_TEMPLATE = """
 .. argparse::
    :ref: {module_name}.get_script_argument_parser
@@ -64,14 +93,15 @@ ARGPARSE_TEMPLATE = """
 """
 
 
-def module_doc_path(module):
-    """Get the path for a module's documentation file."""
+def module_doc_path(module_file):
+    """Get the path for the documentation file of the module at `module_file`."""
     return os.path.join(
         DOCS_DIRECTORY,
         "api_reference",
-        re.sub(r"\.py$", ".rst", os.path.relpath(module.__file__, ROOT_PACKAGE_PATH)),
+        re.sub(r"\.py$", ".rst", os.path.relpath(module_file, ROOT_PACKAGE_PATH)),
     )
 
+
 def package_doc_path(package):
     """Get the path for a package's documentation file."""
     return os.path.join(
@@ -82,11 +112,50 @@ def package_doc_path(package):
     )
 
 
+_created_directories = set()
+_created_directories_lock = threading.Lock()
+
+
+def ensure_directory(path):
+    """Create a directory if it has not already been created by this script."""
+    with _created_directories_lock:
+        if path not in _created_directories:
+            os.makedirs(path, exist_ok=True)
+            _created_directories.add(path)
+
+
 def write_file(path, contents):
-    """Write a file after ensuring that the target directory exists."""
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as out:
-        out.write(contents)
+    """
+    Write a file after ensuring that the target directory exists.
+
+    Contents are encoded up front and written in a single call.
+    """
+    ensure_directory(os.path.dirname(path))
+    with open(path, "wb") as out:
+        out.write(contents.encode("utf-8"))
+
+
+def digest_path(doc_path):
+    """Get the path for the digest of the sources a documentation file is built from."""
+    return f"{doc_path}.sha256"
+
+
+def is_doc_current(doc_path, digest):
+    """Check whether a documentation file exists and was built from `digest`."""
+    if not os.path.exists(doc_path):
+        return False
+
+    try:
+        with open(digest_path(doc_path), "r") as digest_file:
+            return digest_file.read() == digest
+    except FileNotFoundError:
+        return False
+
+
+def write_doc(doc_path, doc, digest):
+    """Write a documentation file along with the digest it was built from."""
+    write_file(doc_path, doc)
+    write_file(digest_path(doc_path), digest)
 
 
 def format_title(title):
@@ -99,8 +168,23 @@ def format_title(title):
     return f"{title}\n{underline}"
 
 
-def write_module_doc(module_name):
-    """Write API reference documentation file for a module."""
+def write_module_doc(module_name, force=False):
+    """
+    Write API reference documentation file for a module and return its path.
+
+    Importing a module can be slow (most modules transitively import Hail), so the
+    module is only imported if its source or this script have changed since its
+    documentation file was last written, or if `force` is set.
+    """
+    module_file = importlib.util.find_spec(module_name).origin
+    doc_path = module_doc_path(module_file)
+
+    with open(module_file, "rb") as source:
+        digest = hashlib.sha256(GENERATOR_SOURCE + source.read()).hexdigest()
+
+    if not force and is_doc_current(doc_path, digest):
+        return doc_path
+
     module = importlib.import_module(module_name)
 
     if hasattr(module, "get_script_argument_parser"):
@@ -115,39 +199,167 @@ def write_module_doc(module_name):
         argparse_doc=argparse_doc,
     )
 
-    doc_path = module_doc_path(module)
-    write_file(doc_path, doc)
+    write_doc(doc_path, doc, digest)
+    return doc_path
+
 
+def iter_modules(paths):
+    """
+    Yield `(name, is_package)` for each module and package directly under `paths`.
 
-def write_package_doc(package_name):
-    """Write API reference documentation file for a package."""
+    This follows the rules `pkgutil.iter_modules` uses for directories on the file
+    system, such as skipping names that contain a "." and only treating directories
+    with an `__init__` module as packages. It uses `os.scandir` so that file types
+    come from the directory listing instead of requiring a separate `stat` call for
+    each entry.
+    """
+    yielded = set()
+    for path in paths:
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir():
+                name = entry.name
+                if "." in name or name in yielded:
+                    continue
+
+                try:
+                    with os.scandir(entry.path) as package_entries:
+                        is_package = any(
+                            package_entry.is_file()
+                            and inspect.getmodulename(package_entry.name) == "__init__"
+                            for package_entry in package_entries
+                        )
+                except OSError:
+                    continue
+
+                if is_package:
+                    yielded.add(name)
+                    yield name, True
+            elif entry.is_file():
+                name = inspect.getmodulename(entry.name)
+                if not name or "." in name or name == "__init__" or name in yielded:
+                    continue
+
+                yielded.add(name)
+                yield name, False
+
+
+def collect_package_modules(package_name, modules, packages):
+    """
+    Collect the modules and packages to document under a package.
+
+    Module names are appended to `modules`. Each package is appended to `packages`
+    along with the links to its members that belong in its index file. Subpackages
+    are appended before their parent package.
+    """
     package = importlib.import_module(package_name)
 
     module_links = []
 
-    for module in pkgutil.iter_modules(package.__path__):
-        if module.name in EXCLUDE_PACKAGES:
+    for module_name, is_package in iter_modules(package.__path__):
+        if module_name in EXCLUDE_PACKAGES:
             continue
 
-        full_module_name = f"{package_name}.{module.name}"
-        if module.ispkg:
-            write_package_doc(full_module_name)
-            module_links.append(f"{module.name} <{module.name}/index>")
+        full_module_name = f"{package_name}.{module_name}"
+        if is_package:
+            collect_package_modules(full_module_name, modules, packages)
+            module_links.append(f"{module_name} <{module_name}/index>")
         else:
-            write_module_doc(full_module_name)
-            module_links.append(f"{module.name} <{module.name}>")
+            modules.append(full_module_name)
+            module_links.append(f"{module_name} <{module_name}>")
 
-    doc = PACKAGE_DOC_TEMPLATE.format(
-        title=format_title(package_name),
-        package_doc=package.__doc__ or "",
-        module_links="\n    ".join(module_links),
-    )
+    packages.append((package, module_links))
 
-    doc_path = package_doc_path(package)
-    write_file(doc_path, doc)
+
+def write_package_doc(package_name, force=False):
+    """
+    Write API reference documentation files for a package and its members.
+
+    Returns the paths of all documentation files for the package, including those
+    that were already up to date.
+
+    Importing modules dominates the time spent here, so when there are enough
+    modules, their documentation is written from a thread pool so that imports can
+    overlap. Package index files only need the list of member links, so they are
+    written after all modules are done. Files for unchanged modules and packages are
+    not rewritten unless `force` is set.
+    """
+    modules = []
+    packages = []
+    collect_package_modules(package_name, modules, packages)
+
+    if len(modules) < MIN_MODULES_FOR_THREAD_POOL:
+        doc_paths = [
+            write_module_doc(module_name, force=force) for module_name in modules
+        ]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(modules))
+        ) as executor:
+            # Consume the results so that exceptions raised in workers propagate.
+            doc_paths = list(
+                executor.map(functools.partial(write_module_doc, force=force), modules)
+            )
+
+    for package, module_links in packages:
+        doc = PACKAGE_DOC_TEMPLATE.format(
+            title=format_title(package.__name__),
+            package_doc=package.__doc__ or "",
+            module_links="\n    ".join(module_links),
+        )
+
+        # The index file only depends on the package and its members, so a digest of
+        # its contents is enough to tell whether it needs to be rewritten.
+        digest = hashlib.sha256(doc.encode("utf-8")).hexdigest()
+        doc_path = package_doc_path(package)
+        if force or not is_doc_current(doc_path, digest):
+            write_doc(doc_path, doc, digest)
+        doc_paths.append(doc_path)
+
+    return doc_paths
+
+
+def remove_stale_docs(doc_paths):
+    """
+    Remove generated documentation files that are not in `doc_paths`.
+
+    Since files for unchanged modules are kept between runs, this removes files
+    left behind by modules and packages that have been deleted or renamed, as well
+    as any directories left empty.
+    """
+    doc_paths = {os.path.normpath(path) for path in doc_paths}
+    api_reference_path = os.path.join(DOCS_DIRECTORY, "api_reference")
+
+    for directory, _, file_names in os.walk(api_reference_path, topdown=False):
+        for file_name in file_names:
+            path = os.path.normpath(os.path.join(directory, file_name))
+            if path.endswith(".rst.sha256"):
+                doc_path = path[: -len(".sha256")]
+            elif path.endswith(".rst"):
+                doc_path = path
+            else:
+                continue
+
+            if doc_path not in doc_paths:
+                os.remove(path)
+
+        if directory != api_reference_path and not os.listdir(directory):
+            os.rmdir(directory)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate all documentation files, even if their sources are unchanged.",
+    )
+    args = parser.parse_args()
+
     packages = setuptools.find_namespace_packages(
         where=REPOSITORY_ROOT_PATH, include=["gnomad_toolbox.*"]
     )
@@ -155,8 +367,9 @@ if __name__ == "__main__":
         pkg for pkg in packages if pkg.count(".") == 1 and pkg not in EXCLUDE_TOP_LEVEL_PACKAGES
     ]
 
+    doc_paths = []
     for pkg in top_level_packages:
-        write_package_doc(pkg)
+        doc_paths.extend(write_package_doc(pkg, force=args.force))
 
     root_doc = PACKAGE_DOC_TEMPLATE.format(
         title=format_title("gnomad_toolbox"),
@@ -167,4 +380,8 @@ if __name__ == "__main__":
         ),
     )
 
-    write_file(os.path.join(DOCS_DIRECTORY, "api_reference", "index.rst"), root_doc)
+    root_doc_path = os.path.join(DOCS_DIRECTORY, "api_reference", "index.rst")
+    write_file(root_doc_path, root_doc)
+    doc_paths.append(root_doc_path)
+
+    remove_stale_docs(doc_paths)